@@ -1,11 +1,18 @@
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
 import pandas as pd
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph
+import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pacsv
+from reportlab.platypus import SimpleDocTemplate, LongTable, TableStyle, Paragraph
 from reportlab.lib.pagesizes import A4
 from reportlab.lib import colors
 from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.lib.utils import simpleSplit
+import orjson
 import hashlib
+import hmac
 import io
 
 # =====================
@@ -13,6 +20,62 @@ import io
 # =====================
 API_BASE = "https://api.feegow.com/v1/api"
 
+@st.cache_resource
+def obter_sessao():
+    #Sessão HTTP única (keep-alive + pool de conexões), sobrevive aos reruns do Streamlit
+    sessao = requests.Session()
+    sessao.mount(
+        "https://",
+        HTTPAdapter(pool_connections=10, pool_maxsize=10, max_retries=3)
+    )
+    sessao.headers.update({"Content-Type": "application/json"})
+    return sessao
+
+SESSION = obter_sessao()
+
+# Únicos campos da proposta usados pelo relatório (campo da API -> coluna exibida).
+# O endpoint proposal/list não documenta parâmetros de projeção (fields) nem de
+# paginação, então a resposta vem completa e o recorte é feito aqui.
+CAMPOS_PROPOSTA = {
+    "proposal_id": "Proposta ID",
+    "proposal_date": "Data",
+    "PacienteID": "Paciente ID",
+    "status": "Status",
+    "value": "Valor Total (R$)",
+    "proposer_name": "Profissional",
+    "unidade.nome_fantasia": "Unidade"
+}
+
+COLUNAS_CATEGORICAS = ("Status", "Profissional", "Unidade", "Paciente ID")
+
+# Troca separadores do formato US (1,234.56) para o BR (1.234,56) numa única passada
+_BR_TRANS = str.maketrans({",": ".", ".": ","})
+
+# Larguras fixas (pt) das colunas do PDF, na ordem de CAMPOS_PROPOSTA, somando a
+# largura útil do A4 (~451pt). As colunas curtas cabem o maior valor esperado em
+# Helvetica 8 (IDs de 10 dígitos, dd/mm/aaaa, 9,999,999.99); as de texto livre
+# quebram linha dentro da célula (_COLUNAS_QUEBRA).
+_LARGURAS_COLUNAS = (54, 50, 54, 65, 58, 90, 80)
+_COLUNAS_QUEBRA = ("Status", "Profissional", "Unidade")
+
+# Estilos do PDF montados uma vez por processo (o módulo é reexecutado a cada rerun)
+@st.cache_resource
+def obter_estilos_pdf():
+    return getSampleStyleSheet()
+
+@st.cache_resource
+def obter_estilo_tabela():
+    return TableStyle([
+        ("BACKGROUND", (0,0), (-1,0), colors.lightgrey),
+        ("GRID", (0,0), (-1,-1), 1, colors.black),
+        ("FONT", (0,0), (-1,0), "Helvetica-Bold"),
+        ("FONTSIZE", (0,0), (-1,-1), 8),
+        ("LEADING", (0,0), (-1,-1), 10),
+        ("LEFTPADDING", (0,0), (-1,-1), 4),
+        ("RIGHTPADDING", (0,0), (-1,-1), 4),
+        ("VALIGN", (0,0), (-1,-1), "TOP"),
+    ])
+
 # =====================
 # AUTH
 # =====================
@@ -27,8 +90,10 @@ def check_password():
     password = st.text_input("Senha", type="password")
 
     if st.button("Entrar"):
-        hashed = hashlib.sha256(password.encode()).hexdigest()
-        if hashed == st.secrets["APP_PASSWORD_HASH"]:
+        #compara os 32 bytes do digest em tempo constante
+        esperado = bytes.fromhex(st.secrets["APP_PASSWORD_HASH"])
+        hashed = hashlib.sha256(password.encode()).digest()
+        if hmac.compare_digest(hashed, esperado):
             st.session_state.authenticated = True
             st.rerun()
         else:
@@ -36,18 +101,13 @@ def check_password():
 
     return False
 
-if not check_password():
-    st.stop()
-
 # =====================
 # FUNÇÕES
 # =====================
+@st.cache_data(ttl=3600, show_spinner="Buscando dados...")
 def listar_propostas(data_inicio, data_fim):
     url = f"{API_BASE}/proposal/list"
-    headers = {
-        "Content-Type": "application/json",
-        "x-access-token": st.secrets["FEEGOW_TOKEN"]
-    }
+    headers = {"x-access-token": st.secrets["FEEGOW_TOKEN"]}
 
     payload = {
         "data_inicio": data_inicio,
@@ -55,14 +115,21 @@ def listar_propostas(data_inicio, data_fim):
         "tipo_data": "I"
     }
 
-    response = requests.get(url, headers=headers, json=payload)
+    response = SESSION.get(
+        url,
+        headers=headers,
+        json=payload,
+        timeout=(5, 30),
+        stream=False
+    )
     response.raise_for_status()
-    return response.json()
+    #orjson faz o parse direto dos bytes, sem o decode utf-8 do json da stdlib
+    return orjson.loads(response.content)
 
 def gerar_pdf(df, data_inicio, data_fim):
     buffer = io.BytesIO()
     doc = SimpleDocTemplate(buffer, pagesize=A4)
-    styles = getSampleStyleSheet()
+    styles = obter_estilos_pdf()
     elements = []
 
     elements.append(Paragraph("<b>Relatório de Propostas</b>", styles["Title"]))
@@ -73,168 +140,264 @@ def gerar_pdf(df, data_inicio, data_fim):
         styles["Normal"]
     ))
 
-    table_data = [df.columns.tolist()] + df.values.tolist()
-    table = Table(table_data, repeatRows=1)
-    table.setStyle(TableStyle([
-        ("BACKGROUND", (0,0), (-1,0), colors.lightgrey),
-        ("GRID", (0,0), (-1,-1), 1, colors.black),
-        ("FONT", (0,0), (-1,0), "Helvetica-Bold"),
-    ]))
+    #formata valor e data uma única vez numa cópia, sem alterar o df exibido na tela
+    df_pdf = df.assign(**{
+        "Data": df["Data"].dt.strftime("%d/%m/%Y").fillna(""),
+        "Valor Total (R$)": df["Valor Total (R$)"].map("{:,.2f}".format)
+    })
+
+    #texto que não cabe na coluna é quebrado em linhas ("\n") para não invadir a
+    #célula vizinha; a quebra é calculada uma vez por categoria, não por linha, e
+    #as células continuam strings simples (bem mais baratas que Paragraph)
+    for coluna in _COLUNAS_QUEBRA:
+        limite = _LARGURAS_COLUNAS[df_pdf.columns.get_loc(coluna)] - 8
+        df_pdf[coluna] = df[coluna].map({
+            valor: "\n".join(simpleSplit(str(valor), "Helvetica", 8, limite))
+            for valor in df[coluna].cat.categories
+        })
+
+    table_data = [[
+        "\n".join(simpleSplit(coluna, "Helvetica-Bold", 8, largura - 8))
+        for coluna, largura in zip(df_pdf.columns, _LARGURAS_COLUNAS)
+    ]]
+    table_data.extend(df_pdf.itertuples(index=False, name=None))
+    #LongTable quebra a tabela por página de forma incremental
+    table = LongTable(table_data, repeatRows=1, colWidths=_LARGURAS_COLUNAS)
+    table.setStyle(obter_estilo_tabela())
 
     elements.append(table)
     doc.build(elements)
     buffer.seek(0)
     return buffer
 
-# =====================
-# UI
-# =====================
-st.title("📊 Relatório de Propostas")
-st.sidebar.header("Filtros")
+@st.cache_data(max_entries=32, show_spinner=False)
+def gerar_csv_bytes(df):
+    #escreve o CSV pelo writer C++ do Arrow, coluna a coluna, sem loop Python por linha
+    tabela = pa.Table.from_pandas(df, preserve_index=False)
+
+    #colunas category viram dictionary no Arrow; o writer de CSV espera os valores.
+    #datas saem como AAAA-MM-DD, sem o horário zerado do timestamp
+    tabela = tabela.cast(pa.schema([
+        pa.field(campo.name, campo.type.value_type)
+        if pa.types.is_dictionary(campo.type)
+        else pa.field(campo.name, pa.date32())
+        if pa.types.is_timestamp(campo.type)
+        else campo
+        for campo in tabela.schema
+    ]))
 
-data_inicio = st.sidebar.date_input("Data início")
-data_fim = st.sidebar.date_input("Data fim")
+    #uma única escrita com o cabeçalho e as aspas padrão do Arrow: todo texto
+    #(inclusive o cabeçalho) sai entre aspas, sempre no mesmo layout
+    buffer = io.BytesIO()
+    pacsv.write_csv(tabela, buffer, pacsv.WriteOptions(include_header=True))
+    return buffer.getvalue()
+
+@st.cache_data(max_entries=32, show_spinner="Gerando PDF...")
+def gerar_pdf_bytes(df, data_inicio, data_fim):
+    #o cache é chaveado pelo conteúdo do df filtrado + período
+    return gerar_pdf(df, data_inicio, data_fim).getvalue()
+
+@st.cache_resource(ttl=3600, show_spinner=False)
+def carregar_df(data_inicio, data_fim):
+    #Monta o DataFrame a partir da API; reexecuções com o mesmo período usam o cache.
+    #cache_resource devolve sempre o mesmo objeto (sem cópia por rerun): o df base
+    #é somente leitura, os filtros geram recortes novos e nunca o alteram.
+    propostas = listar_propostas(data_inicio, data_fim).get("content", [])
+
+    if not propostas:
+        return pd.DataFrame(columns=list(CAMPOS_PROPOSTA.values()))
+
+    #json_normalize achata "unidade" -> "unidade.nome_fantasia" sem criar um dict por linha
+    df = (
+        pd.json_normalize(propostas, sep=".")[list(CAMPOS_PROPOSTA)]
+        .rename(columns=CAMPOS_PROPOSTA)
+    )
 
-# Inicializa estado
-if "df_base" not in st.session_state:
-    st.session_state.df_base = None
+    #Tipos nativos: soma/comparações viram operações NumPy em vez de objetos Python
+    df["Valor Total (R$)"] = pd.to_numeric(df["Valor Total (R$)"], errors="coerce").astype("float64")
+    #IDs em Int64 (inteiro com nulos): um PacienteID vazio não transforma a coluna em float
+    df["Proposta ID"] = pd.to_numeric(df["Proposta ID"], errors="coerce").astype("Int64")
+    df["Paciente ID"] = pd.to_numeric(df["Paciente ID"], errors="coerce").astype("Int64")
+
+    #A API devolve datas ISO (AAAA-MM-DD); o que não for lido vira NaT e a contagem
+    #fica em attrs para a tela avisar o usuário
+    datas = pd.to_datetime(df["Data"], errors="coerce", format="ISO8601")
+    df.attrs["datas_invalidas"] = int((datas.isna() & df["Data"].notna()).sum())
+    df["Data"] = datas
+
+    #Colunas de baixa cardinalidade viram category: unique/isin passam a comparar códigos inteiros
+    for coluna in COLUNAS_CATEGORICAS:
+        df[coluna] = df[coluna].astype("category")
+
+    return df
+
+def opcoes_filtro(df):
+    #lê só as categorias (já ordenadas) do df em cache, sem varrer as linhas
+    return {
+        coluna: df[coluna].cat.categories.tolist()
+        for coluna in COLUNAS_CATEGORICAS
+    }
 
-# BOTÃO APENAS PARA BUSCAR DADOS
-if st.sidebar.button("🔍 Buscar dados"):
-    with st.spinner("Buscando dados..."):
-        resultado = listar_propostas(
-            data_inicio.strftime("%d-%m-%Y"),
-            data_fim.strftime("%d-%m-%Y")
-        )
+def download_sob_demanda(nome, chave, gerar, rotulo, arquivo, mime):
+    #só gera os bytes quando o usuário pede; se os filtros mudarem (chave diferente)
+    #o arquivo preparado anteriormente deixa de ser oferecido
+    estado = f"download_{nome}"
 
-        propostas = resultado.get("content", [])
+    if st.button(f"Preparar {nome}", key=f"preparar_{nome}"):
+        st.session_state[estado] = (chave, gerar())
 
-        if not propostas:
-            st.warning("Nenhuma proposta encontrada.")
-            st.stop()
-
-        st.session_state.df_base = pd.DataFrame([
-            {
-                "Proposta ID": p["proposal_id"],
-                "Data": p["proposal_date"],
-                "Paciente ID": p["PacienteID"],
-                "Status": p["status"],
-                "Valor Total (R$)": p["value"],
-                "Profissional": p["proposer_name"],
-                "Unidade": p["unidade"]["nome_fantasia"]
-            }
-            for p in propostas
-        ])
+    preparado = st.session_state.get(estado)
+    if preparado is not None and preparado[0] == chave:
+        st.download_button(rotulo, preparado[1], arquivo, mime)
 
 # =====================
-# FILTROS (SE DADOS EXISTEM)
+# UI
 # =====================
-if st.session_state.df_base is not None:
-    df = st.session_state.df_base.copy()
-
-    st.sidebar.subheader("Filtros avançados")
-
-    filtro_status = st.sidebar.multiselect(
-        "Status", sorted(df["Status"].dropna().unique())
-    )
-
-    filtro_profissional = st.sidebar.multiselect(
-        "Profissional", sorted(df["Profissional"].dropna().unique())
-    )
+def renderizar():
+    #corpo do app numa função: caminhos vazios usam return em vez de st.stop()
+    if not check_password():
+        return
 
-    filtro_unidade = st.sidebar.multiselect(
-        "Unidade", sorted(df["Unidade"].dropna().unique())
-    )
+    st.title("📊 Relatório de Propostas")
+    st.sidebar.header("Filtros")
 
-    filtro_paciente = st.sidebar.multiselect(
-        "Paciente ID", sorted(df["Paciente ID"].dropna().unique())
-    )
+    data_inicio = st.sidebar.date_input("Data início")
+    data_fim = st.sidebar.date_input("Data fim")
 
-    # APLICAÇÃO EM CASCATA
-    if filtro_status:
-        df = df[df["Status"].isin(filtro_status)]
+    # Inicializa estado (guarda apenas o período buscado, os dados ficam no cache)
+    if "periodo" not in st.session_state:
+        st.session_state.periodo = None
 
-    if filtro_profissional:
-        df = df[df["Profissional"].isin(filtro_profissional)]
+    # BOTÃO APENAS PARA BUSCAR DADOS
+    if st.sidebar.button("🔍 Buscar dados"):
+        periodo = (
+            data_inicio.strftime("%d-%m-%Y"),
+            data_fim.strftime("%d-%m-%Y")
+        )
 
-    if filtro_unidade:
-        df = df[df["Unidade"].isin(filtro_unidade)]
+        #período vazio só avisa: o último resultado válido continua na tela
+        if carregar_df(*periodo).empty:
+            st.warning("Nenhuma proposta encontrada.")
+        else:
+            st.session_state.periodo = periodo
 
-    if filtro_paciente:
-        df = df[df["Paciente ID"].isin(filtro_paciente)]
+    # =====================
+    # FILTROS (SE DADOS EXISTEM)
+    # =====================
+    if st.session_state.periodo is not None:
+        df = carregar_df(*st.session_state.periodo)
 
-    if df.empty:
-        st.warning("Nenhum resultado com os filtros selecionados.")
-        st.stop()
+        if df.attrs.get("datas_invalidas"):
+            st.warning(
+                f"{df.attrs['datas_invalidas']} proposta(s) vieram com data em formato "
+                "inesperado e aparecem sem data."
+            )
 
-    st.metric("Total de Propostas", len(df))
+        opcoes = opcoes_filtro(df)
 
-    valor_total = df["Valor Total (R$)"].sum()
+        st.sidebar.subheader("Filtros avançados")
 
-    #Convertendo para padrão de valor da moeada BR (000,00)
-    valor_formatado = (
-        f"{valor_total:,.2f}"
-        .replace(",", "X")
-        .replace(".", ",")
-        .replace("X", ".")
-    )
+        filtro_status = st.sidebar.multiselect(
+            "Status", opcoes["Status"]
+        )
 
-    st.metric("Valor Total (R$)", f"R$ {valor_formatado}")
+        filtro_profissional = st.sidebar.multiselect(
+            "Profissional", opcoes["Profissional"]
+        )
 
-    st.subheader("Resumo por Filial")
-    periodo_texto = f"{data_inicio.strftime('%d/%m/%Y')} a {data_fim.strftime('%d/%m/%Y')}" #impressão do período filtrado
-    st.markdown(f"**Propostas ({periodo_texto}):**") #Renderiza Markdown no Streamlit
+        filtro_unidade = st.sidebar.multiselect(
+            "Unidade", opcoes["Unidade"]
+        )
 
+        filtro_paciente = st.sidebar.multiselect(
+            "Paciente ID", opcoes["Paciente ID"]
+        )
 
-    #RESUMO:
-    #classifica as propostas em Executadas e Não executadas
-    #agrupa por filial
-    #conta quantas existem de cada tipo
-    #gera uma tabela limpa pronta para exibição ou geração de insights.
-    resumo = (
-        df
-        .assign(
-            Tipo=lambda x: x["Status"].apply(
-                lambda s: "Executada" if s == "Executada" else "Não executada"
-        ) #Cria uma nova coluna chamada Tipo sem modificar o df original.
+        # APLICAÇÃO DOS FILTROS (uma única máscara combinada, um único recorte)
+        filtros = {
+            "Status": filtro_status,
+            "Profissional": filtro_profissional,
+            "Unidade": filtro_unidade,
+            "Paciente ID": filtro_paciente
+        }
+        mascaras = [
+            df[coluna].isin(valores).to_numpy()
+            for coluna, valores in filtros.items()
+            if valores
+        ]
+
+        if mascaras:
+            df = df[np.logical_and.reduce(mascaras)]
+
+        if df.empty:
+            st.warning("Nenhum resultado com os filtros selecionados.")
+            return
+
+        st.metric("Total de Propostas", len(df))
+
+        valor_total = df["Valor Total (R$)"].sum()
+
+        #Convertendo para padrão de valor da moeada BR (000,00)
+        valor_formatado = f"{valor_total:,.2f}".translate(_BR_TRANS)
+
+        st.metric("Valor Total (R$)", f"R$ {valor_formatado}")
+
+        st.subheader("Resumo por Filial")
+        periodo_texto = f"{data_inicio.strftime('%d/%m/%Y')} a {data_fim.strftime('%d/%m/%Y')}" #impressão do período filtrado
+        st.markdown(f"**Propostas ({periodo_texto}):**") #Renderiza Markdown no Streamlit
+
+
+        #RESUMO:
+        #classifica as propostas em Executadas e Não executadas (máscara booleana vetorizada)
+        #agrupa por filial
+        #conta quantas existem de cada tipo: executadas = soma da máscara, total = contagem
+        executada = df["Status"].eq("Executada")
+        resumo = (
+            pd.DataFrame({"Unidade": df["Unidade"], "executadas": executada})
+            .groupby("Unidade", observed=True)["executadas"]
+            .agg(executadas="sum", total="count")
+        )
+        resumo["nao_executadas"] = resumo["total"] - resumo["executadas"]
+        resumo = resumo[["executadas", "nao_executadas"]]
+
+        #monta todas as linhas de uma vez e envia um único st.markdown
+        #Filial A: 5 propostas não aprovadas (todas exceto EXECUTADA) e 12 executadas.
+        linhas = [
+            f"- **{filial}**: {nao_executadas} propostas não aprovadas e {executadas} executadas."
+            for filial, executadas, nao_executadas in resumo.itertuples(name=None)
+        ]
+        st.markdown("\n".join(linhas))
+
+        st.dataframe(
+            df,
+            use_container_width=True,
+            column_config={"Data": st.column_config.DateColumn(format="DD/MM/YYYY")}
         )
-            .groupby(["Unidade", "Tipo"]) #agrupa os dados por unidade e filial
-            .size() #Soma linhas em cada grupo
-            .unstack(fill_value=0) #transroma o nível tipo em colunas
-            .reset_index() #transforma o índice em colunas normais
-    )
 
-    for _, row in resumo.iterrows():
-        #percorre o DataFrame linha por linha
-        #_ → índice (não usamos, por isso o _)
-        #row → um objeto tipo dicionário com os valores da linha
-        filial = row["Unidade"]#Não precisa utilizar o get, pois ela sempre vai existir pois vem do DF base
-        executadas = row.get("Executada", 0) #IMPORTANTE usar o get pq se vier vazio não quebra o app
-        nao_executadas = row.get("Não executada", 0) #IMPORTANTE usar o get pq se vier vazio não quebra o app
-        st.markdown( 
-        #Renderiza uma linha de texto formatada no Streamlit
-            f"- **{filial}**: "
-            f"{nao_executadas} propostas não aprovadas e"
-            f"{executadas} executadas."
-            #- → vira lista (bullet
-            #**{filial}** → nome da filial em negrito
-            #Texto explicativo claro, direto, executivo
-            #Filial A: 5 propostas não aprovadas (todas exceto EXECUTADA) e 12 executadas.
+        #identifica o recorte atual (período buscado, datas do cabeçalho e filtros)
+        chave_recorte = (
+            st.session_state.periodo,
+            data_inicio,
+            data_fim,
+            tuple(tuple(valores) for valores in filtros.values())
         )
 
-    st.dataframe(df, use_container_width=True)
+        download_sob_demanda(
+            "CSV",
+            chave_recorte,
+            lambda: gerar_csv_bytes(df),
+            "📥 Baixar CSV",
+            "relatorio_propostas.csv",
+            "text/csv"
+        )
 
-    st.download_button(
-        "📥 Baixar CSV",
-        df.to_csv(index=False).encode("utf-8"),
-        "relatorio_propostas.csv",
-        "text/csv"
-    )
+        download_sob_demanda(
+            "PDF",
+            chave_recorte,
+            lambda: gerar_pdf_bytes(df, data_inicio, data_fim),
+            "🖨️ Baixar PDF",
+            "relatorio_propostas.pdf",
+            "application/pdf"
+        )
 
-    pdf = gerar_pdf(df, data_inicio, data_fim)
-    st.download_button(
-        "🖨️ Baixar PDF",
-        pdf,
-        "relatorio_propostas.pdf",
-        "application/pdf"
-    )
\ No newline at end of file
+renderizar()